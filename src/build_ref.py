@@ -1,6 +1,6 @@
-import json
-from collections import defaultdict, Counter
-from typing import Dict, List
+import orjson
+from collections import defaultdict
+from typing import Dict, List, Tuple
 import typer
 from tqdm import tqdm
 import openai
@@ -18,93 +18,89 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 if not openai.api_key:
     raise EnvironmentError("❌ OPENAI_API_KEY is not set. Please set it in your environment or .env file.")
 
+# Prompt instructing the LLM to regroup and reformat categories and themes (built once)
+REGROUP_PROMPT = (
+    "Voici une liste de paires thème / catégorie extraites de conversations clients avec leurs fréquences.\n"
+    "Regroupe les catégories similaires entre elles et associe-les à des thèmes cohérents.\n"
+    "Fournis un JSON structuré avec les clés suivantes :\n"
+    "{\n"
+    "  'themes': [\n"
+    "    {\n"
+    "      'theme_id': int (identifiant unique),\n"
+    "      'theme': str (nom du thème en français),\n"
+    "      'frequency': int (somme des fréquences des catégories de ce thème),\n"
+    "      'categories': [\n"
+    "        {\n"
+    "          'category_id': int (identifiant unique de la catégorie dans le thème),\n"
+    "          'category': str (nom de la catégorie en français),\n"
+    "          'frequency': int (nombre d'occurrences),\n"
+    "          'examples': list[str] (exemples en français)\n"
+    "        },\n"
+    "        ...\n"
+    "      ]\n"
+    "    },\n"
+    "    ...\n"
+    "  ]\n"
+    "}\n"
+    "Utilise impérativement ces noms de clés en anglais pour que le fichier soit lisible par une machine, "
+    "mais rédige tous les contenus (noms de thèmes, catégories, exemples) en français.\n"
+    "Réponds uniquement avec ce JSON."
+)
+
 @app.command()
 def regroup_ref_llm(
     labels_path: str = typer.Argument(..., help="Path to labels_output.jsonl"),
     output_path: str = typer.Argument("ref_llm.json", help="Output path for regrouped reference")
 ):
-    # Step 1: Clean input file and remove any invalid JSON lines
-    cleaned_lines = []
+    # Step 1: In a single pass, clean the input file (dropping invalid JSON lines),
+    # count occurrences of (theme, category) pairs and collect example needs
     output_clean_path = "labels_output_clean.json"
+    write_buffer_size = 1 << 20  # Amortize write syscalls over many small lines
+    counts: Dict[Tuple[str, str], int] = defaultdict(int)
+    examples: Dict[Tuple[str, str], List[str]] = defaultdict(list)
 
-    with open(labels_path, "r", encoding="utf-8") as fin, open(output_clean_path, "w", encoding="utf-8") as fout:
+    with open(labels_path, "rb") as fin, open(output_clean_path, "wb", buffering=write_buffer_size) as fout:
         for i, line in enumerate(fin, 1):
             try:
-                json_obj = json.loads(line.strip())  # Parse JSON line
-                fout.write(json.dumps(json_obj, ensure_ascii=False) + "\n")  # Write cleaned JSON
-                cleaned_lines.append(json_obj)  # Save for further processing
-            except json.JSONDecodeError as e:
+                conv = orjson.loads(line)  # Parse JSON line
+            except orjson.JSONDecodeError as e:
                 print(f"❌ Invalid line {i}: {e}")  # Report invalid JSON lines
+                continue
+            fout.write(orjson.dumps(conv) + b"\n")  # Write cleaned JSON
 
-    # Step 2: Count occurrences of (theme, category) pairs and collect example needs
-    label_pairs = []
-    counts = Counter()
-    examples: Dict[str, Dict[str, List[str]]] = defaultdict(lambda: defaultdict(list))
-
-    for conv in cleaned_lines:
-        theme = conv.get("theme", "inconnu")
-        category = conv.get("categorie", "inconnu")
-
-        label_pairs.append({"theme": theme, "categorie": category})
-        counts[(theme, category)] += 1
-
-        # Collect up to 2 example "needs" per (theme, category)
-        for uc in conv.get("use_cases", []):
-            if "besoin" in uc and len(examples[theme][category]) < 2:
-                examples[theme][category].append(uc["besoin"])
+            theme = conv.get("theme", "inconnu")
+            category = conv.get("categorie", "inconnu")
+            key = (theme, category)
+            counts[key] += 1
 
-    # Step 3: Prompt to instruct the LLM to regroup and reformat categories and themes
-    prompt = (
-        "Voici une liste de paires thème / catégorie extraites de conversations clients avec leurs fréquences.\n"
-        "Regroupe les catégories similaires entre elles et associe-les à des thèmes cohérents.\n"
-        "Fournis un JSON structuré avec les clés suivantes :\n"
-        "{\n"
-        "  'themes': [\n"
-        "    {\n"
-        "      'theme_id': int (identifiant unique),\n"
-        "      'theme': str (nom du thème en français),\n"
-        "      'frequency': int (somme des fréquences des catégories de ce thème),\n"
-        "      'categories': [\n"
-        "        {\n"
-        "          'category_id': int (identifiant unique de la catégorie dans le thème),\n"
-        "          'category': str (nom de la catégorie en français),\n"
-        "          'frequency': int (nombre d'occurrences),\n"
-        "          'examples': list[str] (exemples en français)\n"
-        "        },\n"
-        "        ...\n"
-        "      ]\n"
-        "    },\n"
-        "    ...\n"
-        "  ]\n"
-        "}\n"
-        "Utilise impérativement ces noms de clés en anglais pour que le fichier soit lisible par une machine, "
-        "mais rédige tous les contenus (noms de thèmes, catégories, exemples) en français.\n"
-        "Réponds uniquement avec ce JSON."
-    )
+            # Collect up to 2 example "needs" per (theme, category)
+            for uc in conv.get("use_cases", []):
+                if "besoin" in uc and len(examples[key]) < 2:
+                    examples[key].append(uc["besoin"])
 
-    # Step 4: Prepare data to send to OpenAI
-    content_to_send = json.dumps([
-        {"theme": k[0], "categorie": k[1], "frequency": v, "examples": examples[k[0]][k[1]]}
-        for k, v in counts.items()
-    ], ensure_ascii=False)
+    # Step 2: Prepare data to send to OpenAI
+    content_to_send = orjson.dumps([
+        {"theme": theme, "categorie": category, "frequency": v, "examples": examples[(theme, category)]}
+        for (theme, category), v in counts.items()
+    ]).decode("utf-8")
 
     try:
         # Call OpenAI LLM with the prompt and data
         response = openai.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
-                {"role": "system", "content": prompt},
+                {"role": "system", "content": REGROUP_PROMPT},
                 {"role": "user", "content": content_to_send}
             ],
             temperature=0.3
         )
 
-        # Step 5: Parse the JSON returned by the LLM and save it
+        # Step 3: Parse the JSON returned by the LLM and save it
         output = response.choices[0].message.content.strip()
-        parsed = json.loads(output)
+        parsed = orjson.loads(output)
 
-        with open(output_path, "w", encoding="utf-8") as fout:
-            json.dump(parsed, fout, ensure_ascii=False, indent=2)
+        with open(output_path, "wb") as fout:
+            fout.write(orjson.dumps(parsed, option=orjson.OPT_INDENT_2))
 
         print(f"✅ LLM-based reference saved to: {output_path}")
 
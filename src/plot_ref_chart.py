@@ -1,7 +1,8 @@
-import json
+import orjson
 import typer
 import matplotlib.pyplot as plt
-from collections import Counter
+from heapq import nlargest
+from operator import itemgetter
 
 app = typer.Typer()
 
@@ -10,16 +11,17 @@ def plot_chart(
     ref_file: str = typer.Option(..., "--ref-file", help="Path to ref.json"),
     output_file: str = typer.Option("top_categories_chart.png", "--output-file", help="Output image path")
 ):
-    with open(ref_file, "r", encoding="utf-8") as f:
-        ref = json.load(f)
+    with open(ref_file, "rb") as f:
+        ref = orjson.loads(f.read())
 
-    all_categories = []
-    for theme in ref["themes"]:
-        for cat in theme["categories"]:
-            all_categories.append((theme["theme"], cat["category"], cat["frequency"]))
+    all_categories = [
+        (theme["theme"], cat["category"], cat["frequency"])
+        for theme in ref["themes"]
+        for cat in theme["categories"]
+    ]
 
-    # Trier par fréquence globale
-    sorted_cats = sorted(all_categories, key=lambda x: x[2], reverse=True)[:15]
+    # Garder les 15 catégories les plus fréquentes
+    sorted_cats = nlargest(15, all_categories, key=itemgetter(2))
 
     labels = [f"{theme} > {cat}" for theme, cat, _ in sorted_cats]
     freqs = [freq for _, _, freq in sorted_cats]
@@ -1,11 +1,13 @@
 import os
-import json
+import orjson
 import logging
 import typer
 import re
 import unicodedata
 import spacy
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from multiprocessing import Pool
 from pathlib import Path
 
 # Set up basic logging
@@ -22,15 +24,39 @@ MODEL_MAP = {
     'es': 'es_core_news_sm'
 }
 
+# Pipeline components excluded at load time: only the tokenizer is used
+UNUSED_PIPES = ["tok2vec", "tagger", "morphologizer", "parser", "attribute_ruler", "lemmatizer", "ner"]
+
+# Patterns used by clean_text, compiled once
+_RE_PHONE = re.compile(r'PHONE_NUMBER_\d+')
+_RE_DIGITS = re.compile(r"(\d+)")
+_RE_REPEATED_WORD = re.compile(r"\b(\w+)(?: \1\b)+")
+
+# Longest phrase (in words) whose immediate repetition collapse_phrases removes
+MAX_PHRASE_WORDS = 8
+
+# Accent folding for Latin-1 and Latin Extended letters: per-character result of
+# NFKD + ASCII 'ignore' (decomposition works code point by code point), precomputed
+_ASCII_FOLD = str.maketrans({
+    c: unicodedata.normalize('NFKD', c).encode('ascii', 'ignore').decode('ascii')
+    for c in map(chr, range(0x80, 0x250))
+})
+
+# Maps every ASCII char that is not a word char nor whitespace (what
+# [^\w\d\s] matches once text is ASCII-folded) to a space, in one C pass
+_PUNCT_TO_SPACE = str.maketrans({
+    c: ' ' for c in map(chr, range(128)) if not (c.isalnum() or c == '_' or c.isspace())
+})
+
 @lru_cache(maxsize=4)
 def get_tokenizer(lang: str):
-    """Load and return the spaCy tokenizer for the specified language (cached)."""
+    """Load and return the bare spaCy tokenizer for the specified language (cached)."""
     model = MODEL_MAP.get(lang)
     if not model:
         logger.warning(f"No spaCy model found for '{lang}', skipping tokenization.")
         return None
     try:
-        return spacy.load(model)
+        return spacy.load(model, exclude=UNUSED_PIPES).tokenizer
     except Exception as e:
         logger.error(f"Error loading model {model}: {e}")
         return None
@@ -50,16 +76,24 @@ def save_checkpoint(checkpoint_path: Path, idx: int):
 
 def collapse_phrases(text: str) -> str:
     """
-    Remove adjacent repeated phrases.
+    Remove adjacent repeated phrases of two to MAX_PHRASE_WORDS words (case-insensitive),
+    keeping the first occurrence.
     For example: "I am here I am here" -> "I am here"
     """
-    pattern = re.compile(r'\b((?:\w+\s+){2,}?)\1', re.IGNORECASE)
-    while True:
-        new_text = pattern.sub(r'\1', text)
-        if new_text == text:
-            break
-        text = new_text
-    return text
+    words = text.split()
+    folded = [w.lower() for w in words]
+    i = 0
+    while i < len(folded):
+        for k in range(2, min(MAX_PHRASE_WORDS, (len(folded) - i) // 2) + 1):
+            if folded[i + k] == folded[i] and folded[i:i + k] == folded[i + k:i + 2 * k]:
+                del words[i + k:i + 2 * k]
+                del folded[i + k:i + 2 * k]
+                # The deletion may complete a repetition that starts a little earlier
+                i = max(0, i - 2 * MAX_PHRASE_WORDS + 1)
+                break
+        else:
+            i += 1
+    return ' '.join(words)
 
 def clean_text(text: str) -> str:
     """
@@ -70,18 +104,41 @@ def clean_text(text: str) -> str:
     - Remove repetitions
     - Lowercase and strip extra spaces
     """
-    text = unicodedata.normalize('NFKD', text)
-    text = text.encode('ascii', 'ignore').decode('ascii')
-    text = re.sub(r'PHONE_NUMBER_\d+', '', text)
-    text = re.sub(r"[^\w\d\s]", ' ', text)
-    text = re.sub(r"(?<=\D)(?=\d)|(?<=\d)(?=\D)", ' ', text)
-    text = re.sub(r"(\d+)", r" \1 ", text)
-    text = re.sub(r"\b(\d+)( \1\b)+", r"\1", text)
-    text = re.sub(r"\b(\w+)( \1\b)+", r"\1", text)
+    text = text.translate(_ASCII_FOLD)
+    if not text.isascii():
+        # Glyphs outside the folding table: full normalization
+        text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    text = _RE_PHONE.sub('', text)
+    text = text.translate(_PUNCT_TO_SPACE)
+    text = _RE_DIGITS.sub(r" \1 ", text)
+    text = _RE_REPEATED_WORD.sub(r"\1", text)
+    # collapse_phrases also joins words back with single spaces
     text = collapse_phrases(text)
-    text = text.lower()
-    text = re.sub(r"\s+", ' ', text).strip()
-    return text
+    return text.lower()
+
+def _process_file(file: Path, out_path: Path) -> None:
+    """Clean and tokenize the messages of one conversation file (runs in a worker process)."""
+    try:
+        data = orjson.loads(file.read_bytes())
+        lang = data.get('language', 'fr')
+        tokenizer = get_tokenizer(lang)
+        new_messages = []
+        texts = []
+        for msg in data.get('messages', []):
+            cleaned = clean_text(msg.get('text', ''))
+            if cleaned:
+                new_messages.append(msg)
+                texts.append(cleaned)
+        # Tokenize all messages of the conversation in one batched call
+        if tokenizer is not None:
+            texts = [' '.join(token.text for token in doc) for doc in tokenizer.pipe(texts, batch_size=1000)]
+        for msg, text in zip(new_messages, texts):
+            msg['text'] = text
+        data['messages'] = new_messages
+        out_file = out_path / file.name
+        out_file.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    except Exception as e:
+        logger.error(f"Error processing {file.name}: {e}")
 
 @app.command()
 def preprocess(
@@ -107,31 +164,26 @@ def preprocess(
     logger.info(f"Debug: {total} files found in {input_dir}")
     logger.info(f"Resuming from batch index: {start_idx}")
 
-    for idx in range(start_idx, total, batch_size):
-        batch = files[idx: idx + batch_size]
-        logger.info(f"Processing batch {idx} to {idx + len(batch) - 1} out of {total - 1}")
-        for file in batch:
-            try:
-                data = json.loads(file.read_text(encoding='utf-8'))
-                lang = data.get('language', 'fr')
-                tokenizer = get_tokenizer(lang)
-                new_messages = []
-                for msg in data.get('messages', []):
-                    cleaned = clean_text(msg.get('text', ''))
-                    if cleaned:
-                        if tokenizer:
-                            tokens = [token.text for token in tokenizer(cleaned)]
-                            msg['text'] = ' '.join(tokens)
-                        else:
-                            msg['text'] = cleaned
-                        new_messages.append(msg)
-                data['messages'] = new_messages
-                out_file = out_path / file.name
-                out_file.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
-            except Exception as e:
-                logger.error(f"Error processing {file.name}: {e}")
-        save_checkpoint(cp_path, idx + len(batch))
-        logger.info(f"Batch completed, checkpoint saved: {idx + len(batch)}")
+    # Load the tokenizers of all supported languages concurrently up front
+    with ThreadPoolExecutor(max_workers=len(MODEL_MAP)) as pool:
+        list(pool.map(get_tokenizer, MODEL_MAP))
+
+    # Files are independent: spread each batch over all cores. With the fork
+    # start method, workers inherit the tokenizers loaded above; otherwise
+    # each worker loads its own on first use through get_tokenizer's cache
+    worker = partial(_process_file, out_path=out_path)
+    workers = os.cpu_count() or 1
+    with Pool(workers) as pool:
+        for idx in range(start_idx, total, batch_size):
+            batch = files[idx: idx + batch_size]
+            logger.info(f"Processing batch {idx} to {idx + len(batch) - 1} out of {total - 1}")
+            # Checkpoint only once every file of the batch has been written. Chunks are
+            # sized so that each worker gets several of them, even for small batches
+            chunksize = max(1, len(batch) // (4 * workers))
+            for _ in pool.imap_unordered(worker, batch, chunksize=chunksize):
+                pass
+            save_checkpoint(cp_path, idx + len(batch))
+            logger.info(f"Batch completed, checkpoint saved: {idx + len(batch)}")
 
     typer.echo("Preprocessing complete.")
 
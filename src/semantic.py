@@ -1,12 +1,27 @@
-import json
+import asyncio
+import hashlib
 import logging
 import os
+import re
 import glob
-from typing import List, Dict, Any
+import sqlite3
+from collections import OrderedDict, deque
+from contextlib import aclosing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from itertools import chain
+from typing import List, Dict, Any, AsyncIterator, Awaitable, Callable, Iterator, Optional
 import typer
+import httpx
 from tqdm import tqdm
-import openai
-from openai import OpenAIError, RateLimitError
+from openai import (
+    AsyncOpenAI, APIConnectionError, APITimeoutError, BadRequestError, InternalServerError, NotFoundError, RateLimitError
+)
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from aiolimiter import AsyncLimiter
+import tiktoken
+import orjson
+import ijson
 from langdetect import detect
 from dotenv import load_dotenv
 
@@ -19,188 +34,801 @@ logging.basicConfig(level=logging.INFO)
 load_dotenv()
 
 # Retrieve OpenAI API key from environment
-openai.api_key = os.getenv("OPENAI_API_KEY")
-if openai.api_key is None:
+api_key = os.getenv("OPENAI_API_KEY")
+if api_key is None:
     raise ValueError("The environment variable OPENAI_API_KEY is missing. Check your .env file.")
 
-# Define local cache path for conversation labels
-CACHE_PATH = "./label_cache.json"
+# Asynchronous client: labeling is network-bound, so requests are issued concurrently.
+# One shared HTTP/2 connection pool, sized for the concurrency; retries are handled by _retry_transient, not by the client
+client = AsyncOpenAI(
+    api_key=api_key,
+    max_retries=0,
+    http_client=httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=100),
+        timeout=httpx.Timeout(60)
+    )
+)
+
+# Bounds the number of in-flight OpenAI requests (set for each batch_label run, created on first use otherwise)
+DEFAULT_CONCURRENCY = 20
+_request_slots: Optional[asyncio.Semaphore] = None
+
+def _get_request_slots() -> asyncio.Semaphore:
+    global _request_slots
+    if _request_slots is None:
+        _request_slots = asyncio.Semaphore(DEFAULT_CONCURRENCY)
+    return _request_slots
+
+# Account rate limits (requests and tokens per minute), enforced client-side to avoid bursts of 429 errors
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "3500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "200000"))
+rpm_limiter = AsyncLimiter(max_rate=OPENAI_RPM, time_period=60)
+tpm_limiter = AsyncLimiter(max_rate=OPENAI_TPM, time_period=60)
+
+# Input files are parsed by a pool of processes, a bounded number of files (and bytes) ahead of the labeling.
+# Larger files are streamed by the main process one conversation at a time instead
+LOAD_WORKERS = os.cpu_count() or 1
+LOAD_PREFETCH = 4 * LOAD_WORKERS
+LOAD_PREFETCH_BYTES = 256 << 20
+LOAD_STREAM_BYTES = 32 << 20
+
+# Seconds between two status checks of a Batch API job
+BATCH_POLL_INTERVAL = 60
+
+# The Batch API accepts at most 50,000 requests and 200 MB per input file
+BATCH_MAX_REQUESTS = 50_000
+BATCH_MAX_BYTES = 200_000_000
+
+# Local cache of conversation labels, keyed by a hash of the conversation text
+CACHE_PATH = os.getenv("LABEL_CACHE_PATH", "./label_cache.db")
+
+# SQLite in autocommit mode: each label is written (durably, thanks to WAL) as soon as it is known
+conn = sqlite3.connect(CACHE_PATH, isolation_level=None)
+conn.execute("PRAGMA journal_mode=WAL")
+conn.execute("CREATE TABLE IF NOT EXISTS cache(k TEXT PRIMARY KEY, v TEXT)")
+# Batch API jobs not stored yet, keyed by a hash of their input file, so that an interrupted run resumes them
+conn.execute("CREATE TABLE IF NOT EXISTS batch_jobs(k TEXT PRIMARY KEY, job_id TEXT)")
+
+_RE_WHITESPACE = re.compile(r"\s+")
+
+# Texts differing only by whitespace or case share the same cache entry.
+# The namespace is added after canonicalization, where "\x1f" can no longer be collapsed into a space
+def _cache_key(text: str, namespace: str = "") -> str:
+    canonical = _RE_WHITESPACE.sub(" ", text).strip().casefold()
+    if namespace:
+        canonical = namespace + "\x1f" + canonical
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+# In-memory LRU layer in front of SQLite, so conversations repeated within a run skip the database
+MEMORY_CACHE_SIZE = 10_000
+_memory_cache: "OrderedDict[str, Any]" = OrderedDict()
+
+def _remember(key: str, value: Any):
+    _memory_cache[key] = value
+    _memory_cache.move_to_end(key)
+    if len(_memory_cache) > MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+# Return the cached value (label or use cases) of a text, or None if it is not cached yet
+def cache_get(text: str, namespace: str = "") -> Optional[Any]:
+    key = _cache_key(text, namespace)
+    value = _memory_cache.get(key)
+    if value is not None:
+        _memory_cache.move_to_end(key)
+        return value
+    row = conn.execute("SELECT v FROM cache WHERE k=?", (key,)).fetchone()
+    if row is None:
+        return None
+    value = orjson.loads(row[0])
+    _remember(key, value)
+    return value
 
-# Load cache if it exists, otherwise initialize it
-if os.path.exists(CACHE_PATH):
-    with open(CACHE_PATH, "r", encoding="utf-8") as cf:
+# Store the value (label or use cases) of a text
+def cache_put(text: str, value: Any, namespace: str = ""):
+    key = _cache_key(text, namespace)
+    conn.execute("INSERT OR REPLACE INTO cache(k, v) VALUES (?, ?)", (key, orjson.dumps(value).decode("utf-8")))
+    _remember(key, value)
+
+# An exhausted quota will not recover: the run is stopped, keeping the labels written so far
+class QuotaExceededError(Exception):
+    pass
+
+# Rate limits, timeouts, connection and 5xx errors are worth retrying
+def _is_transient(error: BaseException) -> bool:
+    return isinstance(error, (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError))
+
+_backoff = wait_exponential_jitter(initial=1, max=60)
+
+# Wait as long as the server's Retry-After header asks, otherwise back off exponentially (1s, 2s, 4s...)
+def _wait_retry_after(retry_state) -> float:
+    response = getattr(retry_state.outcome.exception(), "response", None)
+    if response is not None:
         try:
-            label_cache = json.load(cf)
-        except json.JSONDecodeError:
-            label_cache = {}
-else:
-    label_cache = {}
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    return _backoff(retry_state)
+
+# Retry policy of every OpenAI call
+_retry_transient = retry(retry=retry_if_exception(_is_transient), wait=_wait_retry_after, stop=stop_after_attempt(6), reraise=True)
+
+# Tokenizer used to estimate the size of a request (loaded on first use)
+@lru_cache(maxsize=1)
+def _encoding():
+    return tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+# Estimate the tokens a request consumes: its messages plus the completion it may generate
+def estimated_tokens(messages: List[Dict[str, str]], max_tokens: int = 0) -> int:
+    encoding = _encoding()
+    prompt_tokens = sum(len(encoding.encode(m["content"])) + 4 for m in messages)
+    return min(prompt_tokens + max_tokens, OPENAI_TPM)
+
+# Very long conversations are sent as their first and last tokens only
+MAX_CONVERSATION_TOKENS = 3000
+
+def truncate_tokens(text: str, max_tokens: int = MAX_CONVERSATION_TOKENS) -> str:
+    encoding = _encoding()
+    ids = encoding.encode(text)
+    if len(ids) <= max_tokens:
+        return text
+    half = max_tokens // 2
+    return encoding.decode(ids[:half] + ids[-half:])
+
+# Send a chat completion request within the rate limits, waiting for a free request slot and retrying transient errors
+@_retry_transient
+async def _chat_create(**kwargs):
+    async with rpm_limiter:
+        await tpm_limiter.acquire(estimated_tokens(kwargs["messages"], kwargs.get("max_tokens") or 0))
+        async with _get_request_slots():
+            try:
+                return await client.chat.completions.create(**kwargs)
+            except RateLimitError as e:
+                if e.code == "insufficient_quota":
+                    raise QuotaExceededError(str(e)) from e
+                raise
+
+# Taxonomy proposed to the model
+THEMES = ['Paiement', 'Connexion', 'Accès', 'Réservation', 'Sortie', 'Compte', 'Information']
+CATEGORIES = ['Carte refusée', 'Mot de passe oublié', 'Code invalide', 'Barrière bloquée', 'Erreur de réservation', 'Compte bloqué', 'Demande de solde']
+
+# English labels of the taxonomy (lower-cased), mapped to their French label
+TAXONOMY_FR = {
+    "payment": "Paiement",
+    "login": "Connexion",
+    "connection": "Connexion",
+    "access": "Accès",
+    "booking": "Réservation",
+    "reservation": "Réservation",
+    "exit": "Sortie",
+    "account": "Compte",
+    "information": "Information",
+    "card declined": "Carte refusée",
+    "card refused": "Carte refusée",
+    "forgotten password": "Mot de passe oublié",
+    "forgot password": "Mot de passe oublié",
+    "invalid code": "Code invalide",
+    "barrier blocked": "Barrière bloquée",
+    "barrier stuck": "Barrière bloquée",
+    "booking error": "Erreur de réservation",
+    "reservation error": "Erreur de réservation",
+    "account locked": "Compte bloqué",
+    "account blocked": "Compte bloqué",
+    "balance request": "Demande de solde",
+    "balance inquiry": "Demande de solde",
+}
 
-# Save updated cache to disk
-def save_cache():
-    with open(CACHE_PATH, "w", encoding="utf-8") as cf:
-        json.dump(label_cache, cf, ensure_ascii=False, indent=2)
+# Labels of the taxonomy are French already: no need to detect their language
+KNOWN_FR_LABELS = {label.lower() for label in THEMES + CATEGORIES}
+_RE_SHORT_LABEL = re.compile(r"[A-Za-zÀ-ÿ'’ \-]{0,40}")
+
+# langdetect is slow, and the same themes and categories come back over and over
+@lru_cache(maxsize=100_000)
+def _detect(text: str) -> str:
+    return detect(text)
+
+# A text is French if it is a label of the taxonomy, or if langdetect says so
+def is_french(text: str) -> bool:
+    if _RE_SHORT_LABEL.fullmatch(text) and text.lower() in KNOWN_FR_LABELS:
+        return True
+    return _detect(text) == 'fr'
 
 # Translate non-French text to French using OpenAI
-def translate_to_french(text: str) -> str:
-    if detect(text) == 'fr':
+async def translate_to_french(text: str) -> str:
+    if is_french(text):
         return text
     try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
+        # Themes and categories are a few words: a small model and a short completion are enough
+        response = await _chat_create(
+            model="gpt-4o-mini",
             messages=[
-                {"role": "system", "content": "Tu es un assistant de traduction. Traduis uniquement en français, sans autre texte ni commentaire."},
-                {"role": "user", "content": f"Traduis ceci : {text}"}
+                {"role": "user", "content": f"Traduis en français, sans autre texte ni commentaire : {text}"}
             ],
+            max_tokens=16,
             temperature=0.0
         )
         translated = response.choices[0].message.content.strip()
         return translated
+    except QuotaExceededError:
+        raise
     except Exception as e:
         logger.warning(f"❌ Traduction échouée pour '{text}' : {e}")
         return text
 
-# Extract use cases from a conversation using GPT
-def extract_use_cases(conversation: Dict[str, Any]) -> List[Dict[str, str]]:
-    cid = conversation.get("conversation_id", "")
+# Translate a theme or category: taxonomy labels are looked up, only the others are sent to OpenAI
+async def label_to_french(label: str) -> str:
+    french = TAXONOMY_FR.get(label.strip().lower())
+    if french is not None:
+        return french
+    return await translate_to_french(label)
+
+# System prompt for use case extraction
+USE_CASES_PROMPT = (
+    "Voici une conversation entre un client et un agent."
+    " Analyse les échanges pour en extraire des cas d’usage sous forme de besoin et solution."
+    " Fournis uniquement un objet JSON dont la clé \"items\" contient une liste de dictionnaires avec deux clés :"
+    " 'besoin' (problème exprimé par le client) et 'solution' (réponse de l’agent). Réponds en français."
+    " Exemple :\n"
+    "{\"items\": [{\"besoin\": \"Je n’arrive pas à payer avec ma carte.\", \"solution\": \"Essayez une autre carte ou redémarrez l’application.\"}]}"
+)
+
+# Use cases are cached next to the labels, under their own keys
+USE_CASES_NAMESPACE = "use_cases"
+
+# Join the messages of a conversation into the dialogue sent for use case extraction
+def conversation_dialogue(conversation: Dict[str, Any]) -> str:
     turns = conversation.get("messages", [])
-    dialogue = "\n".join([f"{m.get('role', '')}: {m.get('text', '')}" for m in turns if m.get("text")])
-
-    prompt = (
-        "Voici une conversation entre un client et un agent."
-        " Analyse les échanges pour en extraire des cas d’usage sous forme de besoin et solution."
-        " Fournis uniquement une liste JSON de dictionnaires avec deux clés : 'besoin' (problème exprimé par le client)"
-        " et 'solution' (réponse de l’agent). Réponds en français, sans aucun texte autour du JSON."
-        " Exemple :\n"
-        "[{\"besoin\": \"Je n’arrive pas à payer avec ma carte.\", \"solution\": \"Essayez une autre carte ou redémarrez l’application.\"}]"
-    )
+    return "\n".join([f"{m.get('role', '')}: {m.get('text', '')}" for m in turns if m.get("text")])
+
+# Build the chat completion request extracting the use cases of a dialogue
+def use_cases_request(dialogue: str) -> Dict[str, Any]:
+    return {
+        "model": "gpt-3.5-turbo-0125",
+        "messages": [
+            {"role": "system", "content": USE_CASES_PROMPT},
+            {"role": "user", "content": f"Conversation:\n{truncate_tokens(dialogue)}"}
+        ],
+        "temperature": 0.2,
+        "response_format": {"type": "json_object"}
+    }
 
+# Parse the use cases returned by the model for a conversation
+def parse_use_cases(content: str, cid: str) -> List[Dict[str, str]]:
+    if not content:
+        logger.warning("Empty response from LLM for conversation ID: %s", cid)
+        return []
     try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo-0125",
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": f"Conversation:\n{dialogue}"}
-            ],
-            temperature=0.2
-        )
-        content = response.choices[0].message.content.strip()
-        if not content:
-            logger.warning("Empty response from LLM for conversation ID: %s", cid)
-            return []
-        return json.loads(content)
-    except json.JSONDecodeError as json_err:
+        return orjson.loads(content)["items"]
+    except (orjson.JSONDecodeError, KeyError) as json_err:
         logger.error("⚠️ Invalid JSON for conversation %s : %s\nResponse: %s", cid, json_err, content)
         return []
+
+# Extract use cases from a conversation using GPT
+async def extract_use_cases(conversation: Dict[str, Any]) -> List[Dict[str, str]]:
+    cid = conversation.get("conversation_id", "")
+    dialogue = conversation_dialogue(conversation)
+    cached = cache_get(dialogue, USE_CASES_NAMESPACE)
+    if cached is not None:
+        return cached
+    try:
+        response = await _chat_create(**use_cases_request(dialogue))
+        use_cases = parse_use_cases(response.choices[0].message.content, cid)
+    except QuotaExceededError:
+        raise
     except Exception as e:
         logger.error("Error extracting use cases for conversation %s: %s", cid, e)
         return []
+    # Empty results may come from an invalid reply: they are asked again on the next run
+    if use_cases:
+        cache_put(dialogue, use_cases, USE_CASES_NAMESPACE)
+    return use_cases
 
-# Label the conversation with theme, category, and confidence score
-def label_conversation_summary(conversation: Dict[str, Any]) -> Dict[str, Any]:
-    cid = conversation.get("conversation_id", "")
+# System prompt for the classification task: one request labels a whole batch of conversations
+LABEL_SYSTEM_PROMPT = (
+    "IMPORTANT : Quelle que soit la langue de la conversation, vous devez d'abord TOUT traduire en français."
+    " Puis analysez la conversation traduite et répondez uniquement en français, sans exception."
+    "Vous êtes un assistant qui analyse une conversation complète et identifie le thème principal ainsi que la catégorie correspondante."
+    " Vous devez généraliser les thèmes et catégories récurrents en un format standardisé."
+    " Commencez par traduire la conversation en français si elle est rédigée dans une autre langue (anglais, espagnol, allemand...)."
+    " Vous recevez une liste JSON de conversations de la forme [{\"id\": 0, \"text\": \"...\"}, ...]."
+    " Utilisez une taxonomie standardisée. Répondez UNIQUEMENT avec un objet JSON dont la clé \"items\" contient"
+    " un objet par conversation, avec le même \"id\", selon la structure suivante :"
+    "\n\n"
+    "Exemple :\n"
+    "{\"items\": [\n  {\"id\": 0, \"theme\": \"Paiement\", \"category\": \"Carte refusée\", \"confidence\": 0.95},\n"
+    "  {\"id\": 1, \"theme\": \"Problème technique\", \"category\": \"La barrière ne s’ouvre pas\", \"confidence\": 0.91}\n]}\n"
+    "\n"
+    f"Liste possible de thèmes : {THEMES}\n"
+    f"Liste possible de catégories : {CATEGORIES}\n"
+    "La réponse doit toujours être en français."
+)
+
+UNKNOWN_LABEL = {"theme": "unknown", "category": "unknown", "confidence": 0.0}
+
+# Join the non-empty messages of a conversation into the text sent for labeling
+def conversation_text(conversation: Dict[str, Any]) -> str:
     texts = [msg.get("text", "") for msg in conversation.get("messages", []) if msg.get("text")]
-    full_text = "\n".join(texts).strip()
-
-    # Handle empty conversations
-    if not full_text:
-        return {"conversation_id": cid, "theme": "unknown", "category": "unknown", "confidence": 0.0}
-
-    # Use cached label if available
-    if full_text in label_cache:
-        return {"conversation_id": cid, **label_cache[full_text]}
-
-    # System prompt for classification task
-    system_prompt = (
-        "IMPORTANT : Quelle que soit la langue de la conversation, vous devez d'abord TOUT traduire en français."
-        " Puis analysez la conversation traduite et répondez uniquement en français, sans exception."
-        "Vous êtes un assistant qui analyse une conversation complète et identifie le thème principal ainsi que la catégorie correspondante."
-        " Vous devez généraliser les thèmes et catégories récurrents en un format standardisé."
-        " Commencez par traduire la conversation en français si elle est rédigée dans une autre langue (anglais, espagnol, allemand...)."
-        " Utilisez une taxonomie standardisée. Répondez UNIQUEMENT en JSON selon la structure suivante :"
-        "\n\n"
-        "Exemple 1 :\n"
-        "{\n  \"theme\": \"Paiement\",\n  \"category\": \"Carte refusée\",\n  \"confidence\": 0.95\n}\n"
-        "\n"
-        "Exemple 2 :\n"
-        "{\n  \"theme\": \"Problème technique\",\n  \"category\": \"La barrière ne s’ouvre pas\",\n  \"confidence\": 0.91\n}\n"
-        "\n"
-        "Liste possible de thèmes : ['Paiement', 'Connexion', 'Accès', 'Réservation', 'Sortie', 'Compte', 'Information']\n"
-        "Liste possible de catégories : ['Carte refusée', 'Mot de passe oublié', 'Code invalide', 'Barrière bloquée', 'Erreur de réservation', 'Compte bloqué', 'Demande de solde']\n"
-        "La réponse doit toujours être en français."
+    return "\n".join(texts).strip()
+
+# Build the chat completion request labeling several conversation texts at once
+def label_request(texts: List[str]) -> Dict[str, Any]:
+    payload = orjson.dumps([{"id": i, "text": truncate_tokens(t)} for i, t in enumerate(texts)]).decode("utf-8")
+    return {
+        "model": "gpt-3.5-turbo-0125",
+        "messages": [
+            {"role": "system", "content": LABEL_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Conversations:\n{payload}"}
+        ],
+        "temperature": 0.0,
+        "response_format": {"type": "json_object"}
+    }
+
+# Context window of the labeling model, the longest reply it can generate,
+# and the reply tokens kept free for each conversation of a request
+LABEL_CONTEXT_TOKENS = 16_385
+LABEL_MAX_REPLY_TOKENS = 4096
+LABEL_REPLY_TOKENS = 40
+
+# Split texts into groups labeled by one request each: at most max_texts texts per group,
+# and few enough tokens that the request and its reply fit in the model's context
+def label_groups(texts: List[str], max_texts: int) -> List[List[str]]:
+    encoding = _encoding()
+    budget = LABEL_CONTEXT_TOKENS - estimated_tokens(label_request([])["messages"])
+    max_texts = min(max_texts, LABEL_MAX_REPLY_TOKENS // LABEL_REPLY_TOKENS)
+    groups: List[List[str]] = []
+    group: List[str] = []
+    used = 0
+    for text in texts:
+        item = orjson.dumps({"id": len(group), "text": truncate_tokens(text)}).decode("utf-8")
+        tokens = len(encoding.encode(item)) + 1 + LABEL_REPLY_TOKENS
+        if group and (used + tokens > budget or len(group) >= max_texts):
+            groups.append(group)
+            group, used = [], 0
+        group.append(text)
+        used += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+# Parse the labels returned by the model, indexed by conversation id
+def parse_label_results(content: str) -> Dict[int, Dict[str, Any]]:
+    return {int(r["id"]): r for r in orjson.loads(content)["items"] if isinstance(r, dict) and "id" in r}
+
+# Turn parsed model results into French labels, keyed by conversation text.
+# Texts without a valid result are left out: callers label them unknown without caching it, so a rerun retries them
+async def labels_from_results(texts: List[str], results: Dict[int, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    labels = {}
+    for i, text in enumerate(texts):
+        result = results.get(i)
+        if result is None:
+            logger.error("No label returned for conversation '%s'", text)
+            continue
+        try:
+            # Translate both theme and category to French if needed
+            theme, category = await asyncio.gather(
+                label_to_french(result.get("theme", "unknown")),
+                label_to_french(result.get("category", "unknown"))
+            )
+            confidence = float(result.get("confidence", 0.0))
+            labels[text] = {"theme": theme, "category": category, "confidence": confidence}
+        except Exception as e:
+            logger.error("Invalid label for conversation '%s': %s", text, e)
+    return labels
+
+# Label several conversation texts with a single request, splitting the batch if it still overflows the context
+async def label_texts(texts: List[str]) -> Dict[str, Dict[str, Any]]:
+    try:
+        response = await _chat_create(**label_request(texts))
+        results = parse_label_results(response.choices[0].message.content)
+    except BadRequestError as e:
+        if e.code == "context_length_exceeded" and len(texts) > 1:
+            half = len(texts) // 2
+            logger.warning("Context length exceeded for %d conversations, splitting the batch", len(texts))
+            first, second = await asyncio.gather(label_texts(texts[:half]), label_texts(texts[half:]))
+            return {**first, **second}
+        logger.error("OpenAI error for a batch of %d conversations: %s", len(texts), e)
+        results = {}
+    except QuotaExceededError:
+        raise
+    except Exception as e:
+        logger.error("OpenAI error for a batch of %d conversations: %s", len(texts), e)
+        results = {}
+    return await labels_from_results(texts, results)
+
+# Labels being requested, by cache key, so that concurrent batches share them
+_inflight: Dict[str, asyncio.Future] = {}
+
+# Label a batch of conversations with theme, category, and confidence score
+async def label_conversation_summaries(conversations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    full_texts = [conversation_text(conv) for conv in conversations]
+
+    # Only send non-empty, uncached texts, each once
+    known = {t: cache_get(t) for t in dict.fromkeys(full_texts) if t}
+    missing = [t for t, label in known.items() if label is None]
+
+    # Texts already being labeled (by a concurrent batch, or earlier in this one) are awaited rather than sent again
+    keys = {t: _cache_key(t) for t in missing}
+    waiting: Dict[str, asyncio.Future] = {}
+    pending = []
+    loop = asyncio.get_running_loop()
+    for text in missing:
+        if keys[text] in _inflight:
+            waiting[text] = _inflight[keys[text]]
+        else:
+            _inflight[keys[text]] = loop.create_future()
+            pending.append(text)
+    if pending:
+        try:
+            new_labels: Dict[str, Dict[str, Any]] = {}
+            for group_labels in await asyncio.gather(*(label_texts(g) for g in label_groups(pending, len(pending)))):
+                new_labels.update(group_labels)
+            for text in pending:
+                label = new_labels.get(text)
+                if label is None:
+                    label = dict(UNKNOWN_LABEL)
+                else:
+                    cache_put(text, label)
+                _inflight[keys[text]].set_result(label)
+                known[text] = label
+        finally:
+            for text in pending:
+                future = _inflight.pop(keys[text])
+                if not future.done():
+                    future.cancel()
+    for text, future in waiting.items():
+        known[text] = await future
+
+    labels = []
+    for conv, full_text in zip(conversations, full_texts):
+        # Empty conversations are not sent to the model
+        label = known[full_text] if full_text else UNKNOWN_LABEL
+        labels.append({"conversation_id": conv.get("conversation_id", ""), **label})
+    return labels
+
+# Label a single conversation with theme, category, and confidence score
+async def label_conversation_summary(conversation: Dict[str, Any]) -> Dict[str, Any]:
+    return (await label_conversation_summaries([conversation]))[0]
+
+# Whole-line // comments of JSONC files
+_JSONC_COMMENT = re.compile(rb"^[ \t]*//[^\n]*\n?", re.M)
+
+# A conversation is an object whose messages, if any, are a list of objects
+def _is_conversation(conversation: Any) -> bool:
+    if not isinstance(conversation, dict):
+        return False
+    messages = conversation.get("messages", [])
+    return isinstance(messages, list) and all(isinstance(m, dict) for m in messages)
+
+# Read the conversations of one small pre-processed JSON/JSONC file (runs in a worker process).
+# A broken file is logged and skipped
+def load_conversations(path: str) -> List[Dict[str, Any]]:
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        data = orjson.loads(raw if path.endswith(".json") else _JSONC_COMMENT.sub(b"", raw))
+    except Exception:
+        logger.exception("Error processing %s", path)
+        return []
+
+    # Handle both list and single dict files
+    conversations = data if isinstance(data, list) else [data]
+
+    # A malformed entry would make the whole batch fail: skip it alone
+    valid = [conv for conv in conversations if _is_conversation(conv)]
+    if len(valid) < len(conversations):
+        logger.warning("Skipped %d malformed conversations in %s", len(conversations) - len(valid), path)
+    return valid
+
+# Parse the top-level entries of a JSON/JSONC file incrementally
+def _iter_entries(path: str) -> Iterator[Any]:
+    with open(path, "rb") as f:
+        # JSONC files are filtered line by line to drop comments, JSON files are read by chunks
+        if path.endswith(".json"):
+            chunks = iter(partial(f.read, 1 << 16), b"")
+        else:
+            chunks = (ln for ln in f if not ln.lstrip().startswith(b"//"))
+
+        # Peek at the first significant byte to know whether the file holds a list or a single conversation
+        head = b""
+        for chunk in chunks:
+            head += chunk
+            if head.strip():
+                break
+
+        # Lists are parsed incrementally and yielded one entry at a time
+        if head.lstrip().startswith(b"["):
+            entries = ijson.sendable_list()
+            parser = ijson.items_coro(entries, "item", use_float=True)
+            for chunk in chain([head], chunks):
+                parser.send(chunk)
+                yield from entries
+                del entries[:]
+            parser.close()
+            yield from entries
+            return
+
+        yield orjson.loads(head + b"".join(chunks))
+
+# Stream the conversations of one large pre-processed JSON/JSONC file (runs in the main process).
+# On error, the conversations read so far are kept and the rest of the file is skipped
+def stream_conversations(path: str) -> Iterator[Dict[str, Any]]:
+    skipped = 0
+    try:
+        for conversation in _iter_entries(path):
+            if _is_conversation(conversation):
+                yield conversation
+            else:
+                skipped += 1
+    except Exception:
+        logger.exception("Error processing %s", path)
+    if skipped:
+        logger.warning("Skipped %d malformed conversations in %s", skipped, path)
+
+# Yield the conversations of all files in lists of at most batch_size.
+# Small files are parsed ahead, in order, by a pool of processes while the event loop keeps labeling
+async def iter_batches(files: List[str], batch_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    loop = asyncio.get_running_loop()
+    buffer: List[Dict[str, Any]] = []
+    remaining = iter(files)
+    # Files in order, with the size and the parsing future of those loaded by the pool (None for streamed files)
+    queued: "deque[tuple[str, int, Optional[asyncio.Future]]]" = deque()
+    queued_bytes = 0
+
+    with ProcessPoolExecutor(max_workers=LOAD_WORKERS) as pool:
+        # The bytes bound may be exceeded by one file, so that at least one file is always being read
+        def prefetch():
+            nonlocal queued_bytes
+            while len(queued) < LOAD_PREFETCH and (not queued or queued_bytes < LOAD_PREFETCH_BYTES):
+                path = next(remaining, None)
+                if path is None:
+                    return
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    size = 0
+                if size > LOAD_STREAM_BYTES:
+                    queued.append((path, 0, None))
+                else:
+                    queued.append((path, size, loop.run_in_executor(pool, load_conversations, path)))
+                    queued_bytes += size
+
+        prefetch()
+        while queued:
+            path, size, loading = queued.popleft()
+            queued_bytes -= size
+            conversations = stream_conversations(path) if loading is None else await loading
+            prefetch()
+            for conv in conversations:
+                buffer.append(conv)
+                if len(buffer) >= batch_size:
+                    yield buffer
+                    buffer = []
+    if buffer:
+        yield buffer
+
+# Label a batch of conversations, extract their use cases and queue the results for writing
+async def label_batch(conversations: List[Dict[str, Any]], results: asyncio.Queue):
+    labels, use_cases = await asyncio.gather(
+        label_conversation_summaries(conversations),
+        asyncio.gather(*(extract_use_cases(conv) for conv in conversations))
     )
+    for label, uc in zip(labels, use_cases):
+        label["use_cases"] = uc
+        await results.put(label)
+
+# Single writer, so that concurrent batches never interleave JSONL lines
+async def write_labels(results: asyncio.Queue, output_path: str):
+    with open(output_path, "wb") as fout, tqdm(desc="Labeling conversations", unit="conv") as progress:
+        while (label := await results.get()) is not None:
+            fout.write(orjson.dumps(label) + b"\n")
+            progress.update()
 
+async def run_batch_label(files: List[str], output_path: str, batch_size: int, concurrency: int):
+    global _request_slots
+    _request_slots = asyncio.Semaphore(concurrency)
+
+    results: asyncio.Queue = asyncio.Queue()
+    writer = asyncio.create_task(write_labels(results, output_path))
+
+    # Batches are read as labeling progresses: at most `concurrency` of them are held in memory
+    batch_slots = asyncio.Semaphore(concurrency)
+    quota_exceeded = asyncio.Event()
+
+    def batch_done(task: asyncio.Task):
+        batch_slots.release()
+        if not task.cancelled() and isinstance(task.exception(), QuotaExceededError):
+            quota_exceeded.set()
+
+    tasks = []
     try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo-0125",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Conversation:\n{full_text}"}
-            ],
-            temperature=0.0
+        async with aclosing(iter_batches(files, batch_size)) as batches:
+            async for batch in batches:
+                await batch_slots.acquire()
+                # No point in reading further once the quota is exhausted
+                if quota_exceeded.is_set():
+                    break
+                task = asyncio.create_task(label_batch(batch, results))
+                task.add_done_callback(batch_done)
+                tasks.append(task)
+        await asyncio.gather(*tasks)
+    finally:
+        # On error, stop the remaining batches and still flush and close the output file
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await results.put(None)
+        await writer
+
+# Call a Batch API or file endpoint, retrying transient errors like chat completions
+@_retry_transient
+async def _api_call(method: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+    return await method(*args, **kwargs)
+
+# Serialize chat completion requests into Batch API input files within the request and size limits
+def batch_input_files(requests: Dict[str, Dict[str, Any]]) -> List[bytes]:
+    files: List[bytes] = []
+    lines: List[bytes] = []
+    size = 0
+    for custom_id, body in requests.items():
+        line = orjson.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}) + b"\n"
+        if lines and (len(lines) >= BATCH_MAX_REQUESTS or size + len(line) > BATCH_MAX_BYTES):
+            files.append(b"".join(lines))
+            lines, size = [], 0
+        lines.append(line)
+        size += len(line)
+    if lines:
+        files.append(b"".join(lines))
+    return files
+
+# Run chat completion requests as OpenAI Batch API jobs, one per input file.
+# The reply content of each job (per custom_id) is passed to store as soon as the job is done,
+# so that a failed job does not discard the others
+async def run_batch_job(requests: Dict[str, Dict[str, Any]], store: Callable[[Dict[str, str]], Awaitable[None]]):
+    outcomes = await asyncio.gather(
+        *(_run_batch_job_part(input_file, store) for input_file in batch_input_files(requests)),
+        return_exceptions=True
+    )
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+
+# Run one Batch API input file as a job and pass its reply content per custom_id to store.
+# A job submitted by an interrupted run for the same input file is resumed instead of submitted again
+async def _run_batch_job_part(input_file: bytes, store: Callable[[Dict[str, str]], Awaitable[None]]):
+    input_key = hashlib.blake2b(input_file, digest_size=16).hexdigest()
+    row = conn.execute("SELECT job_id FROM batch_jobs WHERE k=?", (input_key,)).fetchone()
+    job = None
+    if row is not None:
+        try:
+            job = await _api_call(client.batches.retrieve, row[0])
+        except NotFoundError:
+            logger.warning("Batch API job %s not found, submitting it again", row[0])
+    if job is not None and job.status not in ("failed", "cancelled"):
+        logger.info("Resuming Batch API job %s (%s)", job.id, job.status)
+    else:
+        uploaded = await _api_call(client.files.create, file=("batch_requests.jsonl", input_file), purpose="batch")
+        job = await _api_call(
+            client.batches.create,
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
         )
-        content = response.choices[0].message.content.strip()
-        result = json.loads(content)
-
-        # Translate both theme and category to French if needed
-        theme = translate_to_french(result.get("theme", "unknown"))
-        category = translate_to_french(result.get("category", "unknown"))
-        confidence = float(result.get("confidence", 0.0))
-        label = {"theme": theme, "category": category, "confidence": confidence}
-    except RateLimitError as e:
-        logger.error("Quota exceeded. Details: %s", e)
+        conn.execute("INSERT OR REPLACE INTO batch_jobs(k, job_id) VALUES (?, ?)", (input_key, job.id))
+        logger.info("Submitted Batch API job %s with %d requests", job.id, input_file.count(b"\n"))
+
+    while job.status not in ("completed", "expired", "failed", "cancelled"):
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+        job = await _api_call(client.batches.retrieve, job.id)
+        logger.info("Batch API job %s: %s", job.id, job.status)
+    if job.status in ("failed", "cancelled"):
+        logger.error("Batch API job %s %s: %s", job.id, job.status, job.errors)
         raise typer.Exit(code=2)
-    except Exception as e:
-        logger.error("OpenAI error for conversation '%s': %s", full_text, e)
-        label = {"theme": "unknown", "category": "unknown", "confidence": 0.0}
 
-    # Store result in cache
-    label_cache[full_text] = label
-    save_cache()
-    return {"conversation_id": cid, **label}
+    # Expired jobs still return the requests completed in time
+    replies: Dict[str, str] = {}
+    if job.output_file_id:
+        output = await _api_call(client.files.content, job.output_file_id)
+        for line in output.content.splitlines():
+            result = orjson.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") == 200:
+                replies[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+            else:
+                logger.error("Batch request %s failed: %s", result["custom_id"], result.get("error") or response.get("body"))
+    await store(replies)
+    conn.execute("DELETE FROM batch_jobs WHERE k=?", (input_key,))
+
+# Offline variant of run_batch_label: every request goes through the Batch API
+async def run_batch_api_label(files: List[str], output_path: str, batch_size: int, concurrency: int):
+    global _request_slots
+    _request_slots = asyncio.Semaphore(concurrency)
+
+    conversations = [conv async for batch in iter_batches(files, batch_size) for conv in batch]
+    full_texts = [conversation_text(conv) for conv in conversations]
+
+    # Only label non-empty, uncached texts, each once, at most batch_size per request.
+    # Custom ids are derived from the content, so a rerun rebuilds the input file of an interrupted job identically
+    known = {t: cache_get(t) for t in dict.fromkeys(full_texts) if t}
+    pending = [t for t, label in known.items() if label is None]
+    label_batches = {
+        f"labels-{hashlib.blake2b(orjson.dumps(texts), digest_size=16).hexdigest()}": texts
+        for texts in label_groups(pending, batch_size)
+    }
+    requests = {custom_id: label_request(texts) for custom_id, texts in label_batches.items()}
+
+    # Use cases are requested once per uncached dialogue, for all the conversations sharing it
+    dialogues = [conversation_dialogue(conv) for conv in conversations]
+    use_cases = [cache_get(d, USE_CASES_NAMESPACE) for d in dialogues]
+    use_case_indices: Dict[str, List[int]] = {}
+    for n, (d, cached) in enumerate(zip(dialogues, use_cases)):
+        if cached is None:
+            use_case_indices.setdefault(f"use_cases-{_cache_key(d, USE_CASES_NAMESPACE)}", []).append(n)
+    requests.update({custom_id: use_cases_request(dialogues[ns[0]]) for custom_id, ns in use_case_indices.items()})
+
+    # Replies are cached as soon as their job is done: a rerun only submits what is still missing
+    async def store(replies: Dict[str, str]):
+        for custom_id, content in replies.items():
+            if custom_id in label_batches:
+                texts = label_batches[custom_id]
+                try:
+                    results = parse_label_results(content)
+                except Exception as e:
+                    logger.error("Invalid labels for a batch of %d conversations: %s", len(texts), e)
+                    results = {}
+                for text, label in (await labels_from_results(texts, results)).items():
+                    cache_put(text, label)
+                    known[text] = label
+            else:
+                ns = use_case_indices[custom_id]
+                found = parse_use_cases(content, conversations[ns[0]].get("conversation_id", ""))
+                # Empty results may come from an invalid reply: they are asked again on the next run
+                if found:
+                    cache_put(dialogues[ns[0]], found, USE_CASES_NAMESPACE)
+                for n in ns:
+                    use_cases[n] = found
+
+    # A fully cached rerun has nothing to submit (the Batch API rejects empty input files)
+    if requests:
+        await run_batch_job(requests, store)
+
+    # Texts without a valid label are written unknown, without caching it, so a rerun retries them
+    with open(output_path, "wb") as fout:
+        for n, (conv, full_text) in enumerate(zip(conversations, full_texts)):
+            label = (known[full_text] if full_text else None) or UNKNOWN_LABEL
+            fout.write(orjson.dumps({"conversation_id": conv.get("conversation_id", ""), **label, "use_cases": use_cases[n] or []}) + b"\n")
 
 # Command line interface entrypoint to process a batch of conversations
 @app.command()
 def batch_label(
     input_dir: str = typer.Argument(..., help="Folder containing pre-processed JSON/JSONC files"),
     output_path: str = typer.Argument(..., help="Output JSONL file with one label per conversation"),
-    pattern: str = typer.Option("*.json,*.jsonc", help="Glob patterns, separated by commas")
+    pattern: str = typer.Option("*.json,*.jsonc", help="Glob patterns, separated by commas"),
+    batch_size: int = typer.Option(20, help="Maximum number of conversations labelled per OpenAI request"),
+    concurrency: int = typer.Option(DEFAULT_CONCURRENCY, help="Maximum number of concurrent OpenAI requests"),
+    mode: str = typer.Option("sync", help="'sync' to call the API directly, 'batch' to submit a Batch API job (cheaper, up to 24h)"),
+    deterministic: bool = typer.Option(False, help="Process files in sorted order instead of directory order")
 ):
-    files: List[str] = []
-    for pat in pattern.split(','):
-        files.extend(glob.glob(os.path.join(input_dir, pat.strip())))
-    files = sorted(set(files))
+    if mode not in ("sync", "batch"):
+        logger.error("Unknown mode %s, expected 'sync' or 'batch'", mode)
+        raise typer.Exit(code=1)
+
+    # Files matched by several patterns are kept once, in the order they were found
+    files = list(dict.fromkeys(
+        path for pat in pattern.split(',') for path in glob.iglob(os.path.join(input_dir, pat.strip()))
+    ))
+    if deterministic:
+        files.sort()
 
     if not files:
         logger.error("No files found for patterns %s in %s", pattern, input_dir)
         raise typer.Exit(code=1)
 
-    # Process each conversation file
-    with open(output_path, "w", encoding="utf-8") as fout:
-        for path in tqdm(files, desc="Labeling conversations"):
-            try:
-                raw = open(path, "r", encoding="utf-8").read()
-                data = (
-                    json.loads(raw) if path.endswith(".json")
-                    else json.loads("\n".join(
-                        ln for ln in raw.splitlines() if not ln.strip().startswith("//")
-                    ))
-                )
-
-                # Handle both list and single dict files
-                if isinstance(data, list):
-                    for conv in data:
-                        label = label_conversation_summary(conv)
-                        use_cases = extract_use_cases(conv)
-                        label["use_cases"] = use_cases
-                        fout.write(json.dumps(label, ensure_ascii=False) + "\n")
-                elif isinstance(data, dict):
-                    label = label_conversation_summary(data)
-                    use_cases = extract_use_cases(data)
-                    label["use_cases"] = use_cases
-                    fout.write(json.dumps(label, ensure_ascii=False) + "\n")
-            except Exception:
-                logger.exception("Error processing %s", path)
+    runner = run_batch_label if mode == "sync" else run_batch_api_label
+    try:
+        asyncio.run(runner(files, output_path, batch_size, concurrency))
+    except QuotaExceededError as e:
+        logger.error("Quota exceeded, labeling stopped. Details: %s", e)
+        raise typer.Exit(code=2)
 
     logger.info("Labels written to %s", output_path)
 
@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# The pipeline scripts live in src/ and are not an installed package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+# semantic.py needs an API key and opens its label cache at import: tests use a dummy key and an in-memory cache
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["LABEL_CACHE_PATH"] = ":memory:"
@@ -0,0 +1,117 @@
+import json
+import re
+from itertools import count
+
+import httpx
+from openai import AsyncOpenAI
+
+
+def _completion(content):
+    return {
+        "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "test",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]
+    }
+
+
+def _error(status, code, message, headers=None):
+    return httpx.Response(status, headers=headers, json={"error": {"message": message, "type": code, "code": code, "param": None}})
+
+
+class MockOpenAI:
+    """In-process stand-in for the OpenAI API: chat completions, file uploads and Batch API jobs.
+
+    Every conversation is labeled "Paiement" / "Carte refusée" and gets one use case.
+    Failures are injected through the counters set in __init__, and requests are recorded for inspection.
+    """
+
+    def __init__(self):
+        self.chat_requests = []     # bodies of the chat completions answered
+        self.rate_limited = 0       # next chat completions answered with a 429 rate limit error
+        self.quota_after = None     # chat completions answered before the quota is exhausted
+        self.submitted = []         # input files of the submitted Batch API jobs
+        self.failing_jobs = set()   # ranks (from 1) of the submitted jobs that fail
+        self.poll_errors = 0        # next job status checks answered with a 503 error
+        self.poll_denied = 0        # next job status checks answered with a 403 error
+        self.files = {}
+        self.jobs = {}              # job id -> number of status checks
+        self.failed = set()
+        self._ids = count(1)
+
+    def client(self):
+        return AsyncOpenAI(api_key="test", max_retries=0, http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.handle)))
+
+    def reply(self, body):
+        """Content of the reply to a chat completion request."""
+        user = body["messages"][-1]["content"]
+        if user.startswith("Conversations:\n"):
+            items = json.loads(user[len("Conversations:\n"):])
+            return json.dumps({"items": [
+                {"id": item["id"], "theme": "Paiement", "category": "Carte refusée", "confidence": 0.9} for item in items
+            ]})
+        if user.startswith("Conversation:\n"):
+            return json.dumps({"items": [{"besoin": "b", "solution": "s"}]})
+        return "Traduction"
+
+    def handle(self, request):
+        path = request.url.path
+        if path.endswith("/chat/completions"):
+            if self.quota_after is not None and len(self.chat_requests) >= self.quota_after:
+                return _error(429, "insufficient_quota", "You exceeded your current quota")
+            if self.rate_limited:
+                self.rate_limited -= 1
+                return _error(429, "rate_limit_exceeded", "Rate limit reached", {"retry-after": "0"})
+            body = json.loads(request.content)
+            self.chat_requests.append(body)
+            return httpx.Response(200, json=_completion(self.reply(body)))
+
+        if path.endswith("/files") and request.method == "POST":
+            content = re.search(rb'filename="[^"]*"\r\n(?:[^\r\n]+\r\n)*\r\n(.*?)\r\n--', request.content, re.S).group(1)
+            file_id = f"file-{next(self._ids)}"
+            self.files[file_id] = content
+            return httpx.Response(200, json={
+                "id": file_id, "object": "file", "bytes": len(content), "created_at": 0,
+                "filename": "batch_requests.jsonl", "purpose": "batch", "status": "processed"
+            })
+
+        if path.endswith("/batches") and request.method == "POST":
+            input_file = self.files[json.loads(request.content)["input_file_id"]]
+            self.submitted.append(input_file)
+            job_id = f"batch-{next(self._ids)}"
+            self.jobs[job_id] = 0
+            if len(self.submitted) in self.failing_jobs:
+                self.failed.add(job_id)
+            output = [
+                {"custom_id": line["custom_id"], "response": {"status_code": 200, "body": _completion(self.reply(line["body"]))}}
+                for line in map(json.loads, input_file.splitlines())
+            ]
+            self.files[f"{job_id}-output"] = "\n".join(map(json.dumps, output)).encode()
+            return httpx.Response(200, json=self._job(job_id, "validating"))
+
+        match = re.search(r"/batches/([^/]+)$", path)
+        if match:
+            job_id = match.group(1)
+            if self.poll_errors:
+                self.poll_errors -= 1
+                return _error(503, "server_error", "Service unavailable", {"retry-after": "0"})
+            if self.poll_denied:
+                self.poll_denied -= 1
+                return _error(403, "forbidden", "Forbidden")
+            if job_id not in self.jobs:
+                return _error(404, "not_found", f"No batch {job_id}")
+            self.jobs[job_id] += 1
+            if job_id in self.failed:
+                return httpx.Response(200, json=self._job(job_id, "failed"))
+            if self.jobs[job_id] > 1:
+                return httpx.Response(200, json=self._job(job_id, "completed", f"{job_id}-output"))
+            return httpx.Response(200, json=self._job(job_id, "in_progress"))
+
+        match = re.search(r"/files/([^/]+)/content$", path)
+        if match:
+            return httpx.Response(200, content=self.files[match.group(1)])
+        return _error(404, "not_found", f"No route for {path}")
+
+    def _job(self, job_id, status, output_file_id=None):
+        return {
+            "id": job_id, "object": "batch", "endpoint": "/v1/chat/completions", "input_file_id": "file-0",
+            "completion_window": "24h", "status": status, "created_at": 0, "output_file_id": output_file_id
+        }
@@ -0,0 +1,49 @@
+import pytest
+
+from preprocess import MAX_PHRASE_WORDS, clean_text, collapse_phrases
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("I am here I am here", "I am here"),
+    ("sur la sur la sur la", "sur la"),
+    ("on est bloque on est bloque jusqu a l horaire", "on est bloque jusqu a l horaire"),
+    ("a x a x a x", "a x"),
+    ("code 2 8 2 8", "code 2 8"),
+    # Case-insensitive, the first occurrence is kept
+    ("Et la fleche La fleche", "Et la fleche"),
+    # Single repeated words are left to clean_text
+    ("le le le chat", "le le le chat"),
+    ("Bonjour bonjour", "Bonjour bonjour"),
+    # Removing a repetition can reveal another one
+    ("a b x y x y a b x y", "a b x y"),
+    ("", ""),
+])
+def test_collapse_phrases(text, expected):
+    assert collapse_phrases(text) == expected
+
+
+def test_collapse_phrases_ignores_phrases_longer_than_max():
+    phrase = " ".join(f"w{i}" for i in range(MAX_PHRASE_WORDS + 1))
+    assert collapse_phrases(f"{phrase} {phrase}") == f"{phrase} {phrase}"
+
+
+def test_collapse_phrases_alternating_input():
+    assert collapse_phrases(" ".join(["a x"] * 4000)) == "a x"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Wait, wait, wait, wait, wait, wait.", "wait wait"),
+    ("ouais c'est clair c'est clair", "ouais c est clair"),
+    ("Alors version deux-cent 0 0.6. Deux-cent 0 0.6.", "alors version deux cent 0 0 6"),
+    ("7 2 4 un 9 0 7 2 8 2 8 Et la flèche La flèche", "7 2 4 un 9 0 7 2 8 et la fleche"),
+    ("Appelez le PHONE_NUMBER_12 svp", "appelez le svp"),
+    # Single words are only collapsed when repeated with the same case, one space apart
+    ("le le le chat", "le chat"),
+    ("merci merci beaucoup", "merci beaucoup"),
+    ("Bye bye.", "bye bye"),
+    ("oui, oui,", "oui oui"),
+    ("ganz, ganz schlecht", "ganz ganz schlecht"),
+    ("0 0 6", "0 0 6"),
+])
+def test_clean_text(text, expected):
+    assert clean_text(text) == expected
@@ -0,0 +1,253 @@
+import asyncio
+from types import SimpleNamespace
+
+import orjson
+import pytest
+from aiolimiter import AsyncLimiter
+from typer.testing import CliRunner
+
+import semantic
+from mock_api import MockOpenAI
+from semantic import (
+    USE_CASES_NAMESPACE, QuotaExceededError, _cache_key, cache_get, cache_put, label_conversation_summaries,
+    parse_label_results, parse_use_cases
+)
+
+
+class WordEncoding:
+    """Stand-in for the tiktoken encoding (one token per word): the real one is downloaded on first use."""
+
+    def encode(self, text):
+        return text.split(" ")
+
+    def decode(self, ids):
+        return " ".join(ids)
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    semantic.conn.execute("DELETE FROM cache")
+    semantic.conn.execute("DELETE FROM batch_jobs")
+    semantic._memory_cache.clear()
+    monkeypatch.setattr(semantic, "_encoding", lambda: WordEncoding())
+    monkeypatch.setattr(semantic, "_request_slots", None)
+    # Each test runs its own event loop, and limiters must not be shared between loops
+    monkeypatch.setattr(semantic, "rpm_limiter", AsyncLimiter(semantic.OPENAI_RPM, 60))
+    monkeypatch.setattr(semantic, "tpm_limiter", AsyncLimiter(semantic.OPENAI_TPM, 60))
+
+
+def test_cache_key_ignores_whitespace_and_case():
+    assert _cache_key(" Ma carte\n\test  REFUSEE ") == _cache_key("ma carte est refusee")
+    assert _cache_key("ma carte est refusee") != _cache_key("ma carte est acceptee")
+
+
+@pytest.mark.parametrize("text", ["use_cases bonjour", "use_cases\x1fbonjour", "use_cases\tbonjour"])
+def test_cache_key_namespace_cannot_be_forged_by_the_text(text):
+    assert _cache_key(text) != _cache_key("bonjour", USE_CASES_NAMESPACE)
+
+
+def test_cache_key_namespace_is_canonicalized_like_the_text():
+    assert _cache_key(" Bonjour\n", USE_CASES_NAMESPACE) == _cache_key("bonjour", USE_CASES_NAMESPACE)
+
+
+def test_cache_namespaces_are_separate():
+    label = {"theme": "Paiement", "category": "Carte refusée", "confidence": 0.9}
+    use_cases = [{"besoin": "b", "solution": "s"}]
+    cache_put("bonjour", label)
+    cache_put("bonjour", use_cases, USE_CASES_NAMESPACE)
+    assert cache_get("use_cases bonjour") is None
+
+    # Values are read back from SQLite once the in-memory layer is empty
+    semantic._memory_cache.clear()
+    assert cache_get("Bonjour ") == label
+    assert cache_get("bonjour", USE_CASES_NAMESPACE) == use_cases
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    folder = tmp_path / "clean"
+    folder.mkdir()
+    for i in range(12):
+        conversation = {
+            "conversation_id": str(i),
+            "messages": [{"role": "user", "text": f"ma carte {i} est refusee"}, {"role": "agent", "text": "essayez une autre carte"}]
+        }
+        (folder / f"{i:02d}.jsonc").write_bytes(orjson.dumps(conversation))
+    return folder
+
+
+@pytest.fixture
+def api(monkeypatch):
+    mock = MockOpenAI()
+    monkeypatch.setattr(semantic, "client", mock.client())
+    monkeypatch.setattr(semantic, "BATCH_POLL_INTERVAL", 0)
+    return mock
+
+
+def run_batch_label(corpus, output, *args):
+    return CliRunner().invoke(semantic.app, [str(corpus), str(output), "--batch-size", "3", "--concurrency", "2", *args])
+
+
+def read_labels(output):
+    return [orjson.loads(line) for line in output.read_bytes().splitlines()]
+
+
+def reply(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def test_parse_label_results():
+    content = '{"items": [{"id": 0, "theme": "Paiement"}, {"id": "2", "theme": "Compte"}, {"theme": "Accès"}, "x"]}'
+    assert parse_label_results(content) == {0: {"id": 0, "theme": "Paiement"}, 2: {"id": "2", "theme": "Compte"}}
+
+
+@pytest.mark.parametrize("content", ["not json", '{"labels": []}'])
+def test_parse_label_results_rejects_invalid_replies(content):
+    with pytest.raises(Exception):
+        parse_label_results(content)
+
+
+@pytest.mark.parametrize("content, expected", [
+    ('{"items": [{"besoin": "b", "solution": "s"}]}', [{"besoin": "b", "solution": "s"}]),
+    ("", []),
+    ("not json", []),
+    ('{"cases": []}', []),
+])
+def test_parse_use_cases(content, expected):
+    assert parse_use_cases(content, "c1") == expected
+
+
+def test_inflight_labels_are_shared_between_concurrent_batches(monkeypatch):
+    sent = []
+
+    async def chat_create(**kwargs):
+        items = orjson.loads(kwargs["messages"][-1]["content"][len("Conversations:\n"):])
+        sent.append([item["text"] for item in items])
+        await asyncio.sleep(0.01)
+        return reply(orjson.dumps({"items": [
+            {"id": item["id"], "theme": "Paiement", "category": "Carte refusée", "confidence": 0.9} for item in items
+        ]}).decode())
+
+    monkeypatch.setattr(semantic, "_chat_create", chat_create)
+
+    def conversation(cid, text):
+        return {"conversation_id": cid, "messages": [{"text": text}]}
+
+    async def label_both():
+        return await asyncio.gather(
+            label_conversation_summaries([conversation("1", "carte refusee"), conversation("2", "code invalide")]),
+            label_conversation_summaries([conversation("3", "Code  invalide"), conversation("4", "compte bloque")]),
+        )
+
+    first, second = asyncio.run(label_both())
+    assert sorted(map(sorted, sent)) == [["carte refusee", "code invalide"], ["compte bloque"]]
+    assert [label["conversation_id"] for label in first + second] == ["1", "2", "3", "4"]
+    assert all(label["theme"] == "Paiement" for label in first + second)
+    assert cache_get("code invalide")["category"] == "Carte refusée"
+
+
+def test_quota_exhaustion_stops_with_a_complete_jsonl(monkeypatch, corpus, tmp_path):
+    calls = 0
+
+    async def chat_create(**kwargs):
+        nonlocal calls
+        calls += 1
+        if calls > 8:
+            raise QuotaExceededError("insufficient_quota")
+        user = kwargs["messages"][-1]["content"]
+        if user.startswith("Conversations:\n"):
+            items = orjson.loads(user[len("Conversations:\n"):])
+            return reply(orjson.dumps({"items": [
+                {"id": item["id"], "theme": "Paiement", "category": "Carte refusée", "confidence": 0.9} for item in items
+            ]}).decode())
+        return reply('{"items": [{"besoin": "b", "solution": "s"}]}')
+
+    monkeypatch.setattr(semantic, "_chat_create", chat_create)
+    output = tmp_path / "labels.jsonl"
+    result = run_batch_label(corpus, output)
+
+    assert result.exit_code == 2
+    labels = read_labels(output)
+    assert 0 < len(labels) < 12
+    assert len({label["conversation_id"] for label in labels}) == len(labels)
+    assert all(label.keys() == {"conversation_id", "theme", "category", "confidence", "use_cases"} for label in labels)
+
+
+def test_sync_mode_retries_rate_limited_requests(api, corpus, tmp_path):
+    api.rate_limited = 2
+    output = tmp_path / "labels.jsonl"
+    result = run_batch_label(corpus, output)
+
+    assert result.exit_code == 0
+    labels = read_labels(output)
+    assert sorted(label["conversation_id"] for label in labels) == sorted(str(i) for i in range(12))
+    assert all(label["theme"] == "Paiement" and label["use_cases"] for label in labels)
+
+
+def test_sync_mode_quota_exhaustion_exits_with_code_2(api, corpus, tmp_path):
+    api.quota_after = 5
+    output = tmp_path / "labels.jsonl"
+    result = run_batch_label(corpus, output)
+
+    assert result.exit_code == 2
+    assert all(label["conversation_id"] for label in read_labels(output))
+
+
+def test_batch_mode_labels_every_conversation(api, corpus, tmp_path):
+    output = tmp_path / "labels.jsonl"
+    result = run_batch_label(corpus, output, "--mode", "batch", "--deterministic")
+
+    assert result.exit_code == 0
+    assert [label["conversation_id"] for label in read_labels(output)] == [str(i) for i in range(12)]
+    assert len(api.submitted) == 1
+
+    # A rerun is served by the cache and submits nothing
+    assert run_batch_label(corpus, output, "--mode", "batch").exit_code == 0
+    assert len(api.submitted) == 1
+
+
+def test_batch_mode_keeps_finished_jobs_when_one_fails(api, corpus, tmp_path, monkeypatch):
+    monkeypatch.setattr(semantic, "BATCH_MAX_REQUESTS", 4)
+    api.failing_jobs = {2}
+    output = tmp_path / "labels.jsonl"
+
+    assert run_batch_label(corpus, output, "--mode", "batch").exit_code == 2
+    assert len(api.submitted) == 4
+
+    # Only the requests of the failed job are submitted again
+    api.failing_jobs = set()
+    assert run_batch_label(corpus, output, "--mode", "batch").exit_code == 0
+    assert len(api.submitted) == 5
+    assert len(api.submitted[-1].splitlines()) == 4
+    assert all(label["theme"] == "Paiement" and label["use_cases"] for label in read_labels(output))
+
+
+def test_batch_mode_splits_input_files_by_size(api, corpus, tmp_path, monkeypatch):
+    monkeypatch.setattr(semantic, "BATCH_MAX_BYTES", 2000)
+    output = tmp_path / "labels.jsonl"
+
+    assert run_batch_label(corpus, output, "--mode", "batch").exit_code == 0
+    assert len(api.submitted) > 1
+    assert all(len(input_file) <= 2000 for input_file in api.submitted)
+    assert len(read_labels(output)) == 12
+
+
+def test_batch_mode_retries_polling_errors(api, corpus, tmp_path):
+    api.poll_errors = 2
+    output = tmp_path / "labels.jsonl"
+
+    assert run_batch_label(corpus, output, "--mode", "batch").exit_code == 0
+    assert len(api.submitted) == 1
+
+
+def test_batch_mode_resumes_an_interrupted_job(api, corpus, tmp_path):
+    api.poll_denied = 1
+    output = tmp_path / "labels.jsonl"
+
+    assert run_batch_label(corpus, output, "--mode", "batch").exit_code != 0
+    assert semantic.conn.execute("SELECT COUNT(*) FROM batch_jobs").fetchone() == (1,)
+
+    assert run_batch_label(corpus, output, "--mode", "batch").exit_code == 0
+    assert len(api.submitted) == 1
+    assert semantic.conn.execute("SELECT COUNT(*) FROM batch_jobs").fetchone() == (0,)
+    assert len(read_labels(output)) == 12